@@ -1,10 +1,10 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg
+from psycopg.rows import dict_row
 from .settings import settings
 
 
 def get_conn():
-    return psycopg2.connect(settings.POSTGRES_DSN)
+    return psycopg.connect(settings.POSTGRES_DSN)
 
 
 def init_db():
@@ -40,7 +40,7 @@ def save_result(celery_task_id: str, result: str):
 
 def fetch_result(celery_task_id: str):
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with conn.cursor(row_factory=dict_row) as cur:
             cur.execute(
                 "SELECT celery_task_id, result, created_at FROM task_results WHERE celery_task_id=%s",
                 (celery_task_id,),
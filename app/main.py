@@ -1,15 +1,45 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+
+import psycopg
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
+from psycopg_pool import AsyncConnectionPool
+
 from .settings import settings
 from .db import init_db, fetch_result
-from .stock_data_fetcher.get_stock_list import sync_stock_basic_to_postgres
+from .stock_data_fetcher.get_stock_list import (
+    TushareError,
+    create_http_client,
+    ensure_stock_basic_table,
+    sync_all_stock_basic_to_postgres,
+    sync_stock_basic_to_postgres,
+)
 from .tasks import add
 
-app = FastAPI(title=settings.APP_NAME)
-
 
-@app.on_event("startup")
-def _startup():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     init_db()
+    async with AsyncConnectionPool(settings.POSTGRES_DSN, min_size=1, max_size=4, open=False) as pgpool:
+        async with pgpool.connection() as conn:
+            await ensure_stock_basic_table(conn)
+        async with create_http_client() as http:
+            app.state.pgpool = pgpool
+            app.state.http = http
+            yield
+
+
+app = FastAPI(title=settings.APP_NAME, default_response_class=ORJSONResponse, lifespan=lifespan)
+
+
+@app.exception_handler(TushareError)
+async def _tushare_error_handler(request: Request, exc: TushareError):
+    return ORJSONResponse({"error": "tushare", "msg": str(exc)}, status_code=502)
+
+
+@app.exception_handler(psycopg.Error)
+async def _db_error_handler(request: Request, exc: psycopg.Error):
+    return ORJSONResponse({"error": "db", "msg": str(exc)}, status_code=500)
 
 
 @app.get("/health")
@@ -32,8 +62,21 @@ def get_task_result(task_id: str):
 
 
 @app.post("/stocks/sync")
-def sync_stocks(exchange: str = "", list_status: str = "L", timeout_s: int = 30):
-    try:
-        return sync_stock_basic_to_postgres(exchange=exchange, list_status=list_status, timeout_s=timeout_s)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) from e
+async def sync_stocks(request: Request, exchange: str = "", list_status: str = "L", timeout_s: int = 30):
+    return await sync_stock_basic_to_postgres(
+        request.app.state.pgpool,
+        request.app.state.http,
+        exchange=exchange,
+        list_status=list_status,
+        timeout_s=timeout_s,
+    )
+
+
+@app.post("/stocks/sync_all")
+async def sync_all_stocks(request: Request, list_status: str = "L", timeout_s: int = 30):
+    return await sync_all_stock_basic_to_postgres(
+        request.app.state.pgpool,
+        request.app.state.http,
+        list_status=list_status,
+        timeout_s=timeout_s,
+    )
@@ -1,16 +1,30 @@
 import argparse
+import asyncio
+import functools
+import hashlib
 import json
 import os
-import urllib.error
-import urllib.request
-from datetime import datetime
+import re
+from datetime import timedelta
+from itertools import chain
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Callable, Coroutine, NamedTuple
 
-import psycopg2
-from psycopg2.extras import execute_values
+import httpx
+import ijson
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 未安装 orjson 时退回标准库
+    orjson = None
 
 TUSHARE_API_URL = "https://api.tushare.pro"
+# 未压缩且不超过该大小的响应直接 orjson 解析更快，其余改用 ijson 流式解析
+_STREAM_PARSE_MIN_BYTES = 200 * 1024
+# 同一 (exchange, list_status) 内容未变且在该时间内同步过，则跳过 upsert
+_SYNC_CACHE_TTL = timedelta(hours=1)
 
 DEFAULT_FIELDS = [
     "ts_code",
@@ -32,29 +46,59 @@ DEFAULT_FIELDS = [
     "act_ent_type",
 ]
 
-_dotenv_cache: dict[str, str] | None = None
+ALL_EXCHANGES = ("SSE", "SZSE", "BSE")
+
+
+class TushareError(RuntimeError):
+    pass
+
+
+# 按列存放的 stock_basic 数据，字段顺序与 DEFAULT_FIELDS 一致
+class StockBasicColumns(NamedTuple("_StockBasicColumns", [(f, list) for f in DEFAULT_FIELDS])):
+    __slots__ = ()
+
+    @property
+    def row_count(self) -> int:
+        return len(self.ts_code)
+
+
+_UPSERT_COLS = tuple(DEFAULT_FIELDS)
+_DATE_COLS = ("list_date", "delist_date")
 
+# 日期列以 YYYYMMDD 文本传入，由 PostgreSQL 的 stock_basic_parse_yyyymmdd 解析；非法值写为 NULL
+_UPSERT_SELECT = ", ".join(f"stock_basic_parse_yyyymmdd({c})" if c in _DATE_COLS else c for c in _UPSERT_COLS)
+_UNNEST_ARGS = ", ".join(["%s::text[]"] * len(_UPSERT_COLS))
+_SET_CLAUSE = ", ".join([f"{c} = EXCLUDED.{c}" for c in _UPSERT_COLS if c != "ts_code"] + ["updated_at = now()"])
+_UPSERT_SQL = f"""
+    INSERT INTO stock_basic ({", ".join(_UPSERT_COLS)})
+    SELECT {_UPSERT_SELECT}
+    FROM UNNEST({_UNNEST_ARGS}) AS t({", ".join(_UPSERT_COLS)})
+    ON CONFLICT (ts_code)
+    DO UPDATE SET {_SET_CLAUSE};
+"""
 
+_ENV_PATH = Path(__file__).resolve().parents[2] / ".env"
+_DOTENV_LINE = re.compile(r"""^\s*([^#=\s]+)\s*=\s*["']?(.*?)["']?\s*$""")
+
+
+@functools.cache
 def _load_dotenv() -> dict[str, str]:
-    global _dotenv_cache
-    if _dotenv_cache is not None:
-        return _dotenv_cache
-
-    env_path = Path(__file__).resolve().parents[2] / ".env"
-    values: dict[str, str] = {}
-    if env_path.exists():
-        for raw_line in env_path.read_text(encoding="utf-8").splitlines():
-            line = raw_line.strip()
-            if not line or line.startswith("#") or "=" not in line:
-                continue
-            key, value = line.split("=", 1)
-            key = key.strip()
-            value = value.strip().strip('"').strip("'")
-            if key:
-                values[key] = value
-
-    _dotenv_cache = values
-    return values
+    if not _ENV_PATH.exists():
+        return {}
+    lines = _ENV_PATH.read_text(encoding="utf-8").splitlines()
+    return dict(m.groups() for m in map(_DOTENV_LINE.match, lines) if m)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def _json_loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
 def _get_env(key: str) -> str | None:
@@ -72,26 +116,72 @@ def _require_first_env(*keys: str) -> str:
     raise RuntimeError(f"missing required env: {', '.join(keys)}")
 
 
-def _parse_yyyymmdd(value: Any):
-    if value is None:
-        return None
-    text = str(value).strip()
-    if not text:
-        return None
-    try:
-        return datetime.strptime(text, "%Y%m%d").date()
-    except ValueError:
-        return None
-
-
-def fetch_stock_basic(
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(http2=True, timeout=30.0, headers={"Content-Type": "application/json"})
+
+
+def _should_stream_parse(resp: httpx.Response) -> bool:
+    # gzip 等压缩时 Content-Length 只是压缩后大小，HTTP/2 也可能不带该头，都无法得知解码后大小
+    length = resp.headers.get("content-length")
+    if length is None or resp.headers.get("content-encoding", "identity") != "identity":
+        return True
+    return int(length) > _STREAM_PARSE_MIN_BYTES
+
+
+def _discard(value: Any) -> None:
+    pass
+
+
+async def _parse_body_stream(resp: httpx.Response) -> tuple[dict[str, Any], StockBasicColumns]:
+    # 边解析边把 data.items 的值追加到对应列，不保留逐行数据；依赖 Tushare 先返回 data.fields 再返回 data.items
+    events = ijson.sendable_list()
+    parser = ijson.parse_coro(events, use_float=True)
+    body: dict[str, Any] = {}
+    fields: list[str] = []
+    columns = StockBasicColumns._make([] for _ in StockBasicColumns._fields)
+    appenders: list[Callable[[Any], None]] = []
+    pos = 0
+    rows = 0
+
+    async for chunk in resp.aiter_bytes():
+        parser.send(chunk)
+        for prefix, event, value in events:
+            if prefix == "data.items.item.item":
+                appenders[pos](value)
+                pos += 1
+            elif prefix == "data.items.item":
+                if event == "start_array":
+                    pos = 0
+                elif event == "end_array":
+                    if pos != len(fields):
+                        raise TushareError("tushare response parse failed")
+                    rows += 1
+            elif prefix == "data.items" and event == "start_array":
+                by_name = dict(zip(StockBasicColumns._fields, columns))
+                appenders = [by_name[f].append if f in by_name else _discard for f in fields]
+            elif prefix == "data.fields.item":
+                fields.append(value)
+            elif prefix in ("code", "msg"):
+                body[prefix] = value
+        del events[:]
+    parser.close()
+
+    # 响应中没有的字段补 None
+    for col in columns:
+        if len(col) != rows:
+            col.extend([None] * rows)
+    return body, columns
+
+
+async def fetch_stock_basic(
+    client: httpx.AsyncClient,
     token: str,
     *,
     exchange: str = "",
     list_status: str = "L",
     fields: list[str] | None = None,
     timeout_s: int = 30,
-) -> list[dict[str, Any]]:
+) -> StockBasicColumns:
     use_fields = fields or DEFAULT_FIELDS
     payload = {
         "api_name": "stock_basic",
@@ -100,133 +190,156 @@ def fetch_stock_basic(
         "fields": ",".join(use_fields),
     }
 
-    req = urllib.request.Request(
-        TUSHARE_API_URL,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-
     try:
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            raw = resp.read().decode("utf-8")
-    except urllib.error.HTTPError as e:
-        raise RuntimeError(f"tushare http error: {e.code}") from e
-    except urllib.error.URLError as e:
-        raise RuntimeError("tushare request failed") from e
-
-    body = json.loads(raw)
+        async with client.stream("POST", TUSHARE_API_URL, content=_json_dumps(payload), timeout=timeout_s) as resp:
+            resp.raise_for_status()
+            if _should_stream_parse(resp):
+                body, columns = await _parse_body_stream(resp)
+            else:
+                body, columns = _json_loads(await resp.aread()), None
+    except httpx.HTTPStatusError as e:
+        raise TushareError(f"tushare http error: {e.response.status_code}") from e
+    except httpx.HTTPError as e:
+        raise TushareError("tushare request failed") from e
+    except (ValueError, IndexError, ijson.JSONError) as e:
+        raise TushareError("tushare response parse failed") from e
+
     if body.get("code") != 0:
-        raise RuntimeError(f"tushare error: {body.get('msg')}")
+        raise TushareError(f"tushare error: {body.get('msg')}")
+    if columns is not None:
+        return columns
 
     data = body.get("data") or {}
     resp_fields: list[str] = data.get("fields") or []
     items: list[list[Any]] = data.get("items") or []
-    return [dict(zip(resp_fields, item, strict=False)) for item in items]
+    if any(len(item) != len(resp_fields) for item in items):
+        raise TushareError("tushare response parse failed")
+
+    # 在 C 层一次性转置为列，缺失的字段补 None
+    transposed = list(zip(*items)) or [()] * len(resp_fields)
+    idx = {f: i for i, f in enumerate(resp_fields)}
+    return StockBasicColumns._make(
+        list(transposed[idx[f]]) if f in idx else [None] * len(items) for f in StockBasicColumns._fields
+    )
 
 
-def ensure_stock_basic_table(conn) -> None:
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS stock_basic (
-                ts_code TEXT PRIMARY KEY,
-                symbol TEXT,
-                name TEXT,
-                area TEXT,
-                industry TEXT,
-                fullname TEXT,
-                enname TEXT,
-                cnspell TEXT,
-                market TEXT,
-                exchange TEXT,
-                curr_type TEXT,
-                list_status TEXT,
-                list_date DATE,
-                delist_date DATE,
-                is_hs TEXT,
-                act_name TEXT,
-                act_ent_type TEXT,
-                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
-            );
+_CREATE_STOCK_BASIC_SQL = """
+    CREATE TABLE IF NOT EXISTS stock_basic (
+        ts_code TEXT PRIMARY KEY,
+        symbol TEXT,
+        name TEXT,
+        area TEXT,
+        industry TEXT,
+        fullname TEXT,
+        enname TEXT,
+        cnspell TEXT,
+        market TEXT,
+        exchange TEXT,
+        curr_type TEXT,
+        list_status TEXT,
+        list_date DATE,
+        delist_date DATE,
+        is_hs TEXT,
+        act_name TEXT,
+        act_ent_type TEXT,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+_CREATE_STOCK_BASIC_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_stock_basic_exch_status ON stock_basic (exchange, list_status);"
+)
+
+_CREATE_SYNC_META_SQL = """
+    CREATE TABLE IF NOT EXISTS stock_basic_sync_meta (
+        exchange TEXT NOT NULL,
+        list_status TEXT NOT NULL,
+        items_sha256 TEXT NOT NULL,
+        fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (exchange, list_status)
+    );
+"""
+
+# 去掉首尾空白后按 YYYYMMDD 解析，格式或日期不合法（如 20230230、00000101）时返回 NULL；
+# 纯 SQL 表达式不会抛错，且可被规划器内联，没有 plpgsql 异常块的子事务开销
+_CREATE_PARSE_DATE_FUNC_SQL = """
+    CREATE OR REPLACE FUNCTION stock_basic_parse_yyyymmdd(value TEXT) RETURNS DATE
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $fn$
+        SELECT CASE
+            WHEN btrim(value) ~ '^([1-9][0-9]{3}|0[1-9][0-9]{2}|00[1-9][0-9]|000[1-9])(0[1-9]|1[0-2])(0[1-9]|[12][0-9]|3[01])$'
+            THEN CASE
+                WHEN extract(month FROM make_date(substr(btrim(value), 1, 4)::int, substr(btrim(value), 5, 2)::int, 1)
+                                      + (substr(btrim(value), 7, 2)::int - 1)) = substr(btrim(value), 5, 2)::int
+                THEN make_date(substr(btrim(value), 1, 4)::int, substr(btrim(value), 5, 2)::int, 1)
+                     + (substr(btrim(value), 7, 2)::int - 1)
+            END
+        END
+    $fn$;
+"""
+
+
+# 建表、索引、函数只在启动时执行一次并单独提交：CREATE INDEX 会对 stock_basic 加 ShareLock，
+# 若放在每次同步的事务里，并发同步会互相阻塞甚至死锁
+async def ensure_stock_basic_table(conn) -> None:
+    async with conn.cursor() as cur:
+        await cur.execute(_CREATE_STOCK_BASIC_SQL)
+        await cur.execute(_CREATE_STOCK_BASIC_INDEX_SQL)
+        await cur.execute(_CREATE_SYNC_META_SQL)
+        await cur.execute(_CREATE_PARSE_DATE_FUNC_SQL)
+
+
+def _columns_digest(columns: StockBasicColumns) -> str:
+    return hashlib.sha256(_json_dumps(list(columns))).hexdigest()
+
+
+async def _is_recently_synced(conn, exchange: str, list_status: str, digest: str) -> bool:
+    async with conn.cursor() as cur:
+        await cur.execute(
             """
+            SELECT 1 FROM stock_basic_sync_meta
+            WHERE exchange=%s AND list_status=%s AND items_sha256=%s AND fetched_at > now() - %s
+            """,
+            (exchange, list_status, digest, _SYNC_CACHE_TTL),
         )
+        return await cur.fetchone() is not None
 
 
-def upsert_stock_basic(conn, rows: Iterable[dict[str, Any]]) -> int:
-    columns = [
-        "ts_code",
-        "symbol",
-        "name",
-        "area",
-        "industry",
-        "fullname",
-        "enname",
-        "cnspell",
-        "market",
-        "exchange",
-        "curr_type",
-        "list_status",
-        "list_date",
-        "delist_date",
-        "is_hs",
-        "act_name",
-        "act_ent_type",
-    ]
-
-    values = []
-    for row in rows:
-        values.append(
-            (
-                row.get("ts_code"),
-                row.get("symbol"),
-                row.get("name"),
-                row.get("area"),
-                row.get("industry"),
-                row.get("fullname"),
-                row.get("enname"),
-                row.get("cnspell"),
-                row.get("market"),
-                row.get("exchange"),
-                row.get("curr_type"),
-                row.get("list_status"),
-                _parse_yyyymmdd(row.get("list_date")),
-                _parse_yyyymmdd(row.get("delist_date")),
-                row.get("is_hs"),
-                row.get("act_name"),
-                row.get("act_ent_type"),
-            )
+async def _record_sync(conn, exchange: str, list_status: str, digest: str) -> None:
+    async with conn.cursor() as cur:
+        await cur.execute(
+            """
+            INSERT INTO stock_basic_sync_meta (exchange, list_status, items_sha256, fetched_at)
+            VALUES (%s, %s, %s, now())
+            ON CONFLICT (exchange, list_status)
+            DO UPDATE SET items_sha256 = EXCLUDED.items_sha256, fetched_at = EXCLUDED.fetched_at;
+            """,
+            (exchange, list_status, digest),
         )
 
-    if not values:
-        return 0
 
-    set_columns = [c for c in columns if c != "ts_code"]
-    set_clause = ", ".join([f"{c} = EXCLUDED.{c}" for c in set_columns] + ["updated_at = now()"])
-    insert_sql = f"""
-        INSERT INTO stock_basic ({", ".join(columns)})
-        VALUES %s
-        ON CONFLICT (ts_code)
-        DO UPDATE SET {set_clause};
-    """
+async def upsert_stock_basic(conn, columns: StockBasicColumns) -> int:
+    if not columns.row_count:
+        return 0
 
-    with conn.cursor() as cur:
-        execute_values(cur, insert_sql, values, page_size=2000)
+    async with conn.cursor() as cur:
+        await cur.execute(_UPSERT_SQL, list(columns), prepare=True)
 
-    return len(values)
+    return columns.row_count
 
 
-def sync_stock_basic_to_postgres(
+async def sync_stock_basic_to_postgres(
+    pool: AsyncConnectionPool,
+    client: httpx.AsyncClient,
     *,
     exchange: str = "",
     list_status: str = "L",
     fields: list[str] | None = None,
     timeout_s: int = 30,
-) -> dict[str, int]:
+) -> dict[str, Any]:
     token = _require_first_env("TUSHARE_TOKEN", "TUSHARE_PRO_TOKEN")
-    dsn = _require_first_env("POSTGRES_DSN")
 
-    rows = fetch_stock_basic(
+    columns = await fetch_stock_basic(
+        client,
         token,
         exchange=exchange,
         list_status=list_status,
@@ -234,39 +347,99 @@ def sync_stock_basic_to_postgres(
         timeout_s=timeout_s,
     )
 
-    with psycopg2.connect(dsn) as conn:
-        ensure_stock_basic_table(conn)
-        saved = upsert_stock_basic(conn, rows)
+    return await _save_stock_basic(pool, exchange, list_status, columns)
 
-    return {"fetched": len(rows), "saved": saved}
 
+async def _gather_or_cancel(*coros: Coroutine[Any, Any, Any]) -> list[Any]:
+    # Python 3.10 没有 TaskGroup：任一任务失败时取消其余任务并回收其结果，避免 "exception was never retrieved"
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
-def main() -> None:
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--exchange", default="")
-    parser.add_argument("--list-status", default="L")
-    parser.add_argument("--timeout-s", type=int, default=30)
-    parser.add_argument("--dry-run", action="store_true")
-    args = parser.parse_args()
 
+async def sync_all_stock_basic_to_postgres(
+    pool: AsyncConnectionPool,
+    client: httpx.AsyncClient,
+    *,
+    exchanges: tuple[str, ...] = ALL_EXCHANGES,
+    list_status: str = "L",
+    fields: list[str] | None = None,
+    timeout_s: int = 30,
+) -> dict[str, Any]:
     token = _require_first_env("TUSHARE_TOKEN", "TUSHARE_PRO_TOKEN")
-    rows = fetch_stock_basic(
-        token,
-        exchange=args.exchange,
-        list_status=args.list_status,
-        timeout_s=args.timeout_s,
+
+    results = await _gather_or_cancel(
+        *(
+            fetch_stock_basic(
+                client,
+                token,
+                exchange=e,
+                list_status=list_status,
+                fields=fields,
+                timeout_s=timeout_s,
+            )
+            for e in exchanges
+        )
     )
 
+    columns = StockBasicColumns._make(list(chain.from_iterable(parts)) for parts in zip(*results))
+    return await _save_stock_basic(pool, ",".join(exchanges), list_status, columns)
+
+
+async def _save_stock_basic(
+    pool: AsyncConnectionPool,
+    exchange: str,
+    list_status: str,
+    columns: StockBasicColumns,
+) -> dict[str, Any]:
+    digest = _columns_digest(columns)
+    async with pool.connection() as conn:
+        if await _is_recently_synced(conn, exchange, list_status, digest):
+            return {"fetched": columns.row_count, "saved": 0, "cached": True}
+        saved = await upsert_stock_basic(conn, columns)
+        await _record_sync(conn, exchange, list_status, digest)
+
+    return {"fetched": columns.row_count, "saved": saved, "cached": False}
+
+
+async def _run(args: argparse.Namespace) -> None:
+    token = _require_first_env("TUSHARE_TOKEN", "TUSHARE_PRO_TOKEN")
+    async with create_http_client() as client:
+        columns = await fetch_stock_basic(
+            client,
+            token,
+            exchange=args.exchange,
+            list_status=args.list_status,
+            timeout_s=args.timeout_s,
+        )
+
     if args.dry_run:
-        print(json.dumps({"fetched": len(rows)}, ensure_ascii=False))
+        print(json.dumps({"fetched": columns.row_count}, ensure_ascii=False))
         return
 
     dsn = _require_first_env("POSTGRES_DSN")
-    with psycopg2.connect(dsn) as conn:
-        ensure_stock_basic_table(conn)
-        saved = upsert_stock_basic(conn, rows)
+    async with await psycopg.AsyncConnection.connect(dsn) as conn:
+        await ensure_stock_basic_table(conn)
+        await conn.commit()
+        saved = await upsert_stock_basic(conn, columns)
+
+    print(json.dumps({"fetched": columns.row_count, "saved": saved}, ensure_ascii=False))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exchange", default="")
+    parser.add_argument("--list-status", default="L")
+    parser.add_argument("--timeout-s", type=int, default=30)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
 
-    print(json.dumps({"fetched": len(rows), "saved": saved}, ensure_ascii=False))
+    asyncio.run(_run(args))
 
 
 if __name__ == "__main__":